@@ -27,17 +27,40 @@ colours = ['red', 'green', 'cyan', 'magenta', 'blue']
 
 class Scores:
     """Top level scores data structure, stores Level objects."""
+    __slots__ = ('__levels', '__sorted_cache', '__name_count', '__chunk_buckets')
+
     def __init__(self):
         self.__levels = {}
+        # Levels sorted by id, rebuilt on demand after a new level is added
+        self.__sorted_cache = None
+        # Name records binned by their first middle chunk byte, mapping to [lowest level id, highest level id, value length]
+        # The length is from the highest level, as if the records were binned in level order
+        self.__name_count    = 0
+        self.__chunk_buckets = {}
 
     def add_record(self, record):
         if record.level in self.__levels:
             self.__levels[record.level].add_record(record)
         else:
             self.__levels[record.level] = Level(record)
+            self.__sorted_cache = None
+        if record.label == "name":
+            self.__name_count += 1
+            id_int = self.__levels[record.level].id_int
+            bucket = self.__chunk_buckets.get(record.mid_chunk[0])
+            if bucket is None:
+                self.__chunk_buckets[record.mid_chunk[0]] = [id_int, id_int, len(record.value)]
+            else:
+                if id_int < bucket[0]:
+                    bucket[0] = id_int
+                if id_int > bucket[1]:
+                    bucket[1] = id_int
+                    bucket[2] = len(record.value)
 
     def __sorted_levels(self):
-        return sorted(self.__levels.values(), key=lambda x: int(x.id))
+        if self.__sorted_cache is None:
+            self.__sorted_cache = sorted(self.__levels.values(), key=lambda x: x.id_int)
+        return self.__sorted_cache
 
     def get_levels(self):
         return self.__sorted_levels()
@@ -45,6 +68,16 @@ class Scores:
     def get_level(self, level):
         return self.__levels[level]
 
+    def get_name_count(self):
+        return self.__name_count
+
+    def get_chunk_buckets(self):
+        """Returns (first middle chunk byte, value length) pairs binned from the name records, sorted by length.
+
+        Each length is from the highest level in the bucket, and equal lengths are ordered by the lowest level in the bucket."""
+        buckets = sorted(self.__chunk_buckets.items(), key=lambda b: (b[1][2], b[1][0]))
+        return [(mid, length) for mid, (_, _, length) in buckets]
+
     def get_records_by_label(self, label):
         return filter(lambda r: r is not None, ( l.get_record(label) for l in self.__sorted_levels() ))
 
@@ -56,28 +89,32 @@ class Scores:
 
 class Level:
     """Stores all of the ScoreRecord instances for a given game level."""
+    __slots__ = ('id', 'id_int', 'scores', 'name', '__by_label')
+
     def __init__(self, record):
         self.id     = record.level
+        self.id_int = int(record.level)
         self.scores = [ record ]
         self.name   = None
+        # Index of the first record seen for each label, for get_record
+        self.__by_label = { record.label: record }
         if record.label == "name":
             self.name = record.value
 
     def add_record(self, record):
+        # Check before storing anything, so a rejected record isn't left half added
+        if record.label == "name" and self.name is not None:
+            raise ValueError("tried to add multiple name records to Level")
         self.scores.append(record)
+        self.__by_label.setdefault(record.label, record)
         if record.label == "name":
-            if self.name is not None:
-                raise ValueError("tried to add multiple name records to Level")
             self.name = record.value
 
     def get_records(self):
         return self.scores
 
     def get_record(self, label):
-        for r in self.scores:
-            if r.label == label:
-                return r
-        return None
+        return self.__by_label.get(label)
 
     def get_name(self):
         return self.name if self.name is not None else "???"
@@ -90,84 +127,126 @@ class Level:
         return s
 
 def format_bytes(bs):
-    return ' '.join(['{:02X}'.format(b) for b in bs])
+    return bs.hex(' ').upper()
 def format_decimals(bs):
-    return ' '.join([str(b) for b in bs])
+    return ' '.join(map(str, bs))
+def format_bytes_and_decimals(bs):
+    return format_bytes(bs), format_decimals(bs)
+
+# Numeric values appear to be at the end of records, strings are variable length.
+# Prebuilt formats for the trailing 4 byte numeric values, so each record doesn't need to slice them out.
+uint32  = struct.Struct('<I')
+float32 = struct.Struct('<f')
+
+# Each parser takes the record contents after the identifier, and returns a (val_type, value) pair.
+def parse_float(rest, level, label):
+    return 'float', float32.unpack_from(rest, -4)[0]
+
+def parse_string(rest, level, label):
+    # TODO: why do string values start at this position?
+    lenValue = rest[9]
+    value = rest[10:10+lenValue].decode("utf-8")
+    if len(value) != lenValue:
+        printerr(f"String length value {lenValue} does not match extracted string '{value}'")
+    return 'string', value
+
+def parse_int(rest, level, label):
+    if len(rest) >= 4:
+        value = uint32.unpack_from(rest, -4)[0]
+    else:
+        # Too short for a full value, which unpack_from rejects, so keep the old behaviour of using whatever is there
+        value = int.from_bytes(rest, byteorder='little')
+    check_int(level, label, value)
+    return 'int', value
+
+def check_int(level, label, value):
+    if label == 'levelbeaten' and value != int(level):
+        printerr(f"levelbeaten value {value} does not match expected value of the level tag {level}")
+
+# Labels not listed here are assumed to be ints
+label_parsers = {
+    'seconds': parse_float,
+    'minutes': parse_float,
+    'name':    parse_string,
+}
+
+# Numeric records are nearly always exactly the identifier, the 9 byte middle chunk, then the value.
+# Compiled layouts of these whole records, keyed by (identifierLen, label), so each can be unpacked in one call.
+record_shapes = {}
+
+def record_shape(identifierLen, label, parser):
+    key = (identifierLen, label)
+    shape = record_shapes.get(key)
+    if shape is None:
+        val_type, fmt = ('float', 'f') if parser is parse_float else ('int', 'I')
+        # Skip the start marker, identifier length, and identifier, which have already been parsed
+        shape = record_shapes[key] = (val_type, struct.Struct(f'<2x{identifierLen}x9s{fmt}'))
+    return shape
 
 class ScoreRecord:
-    """Represents an individual records in the scores file. The constructor expects a raw bytes instance of a single record, which will be parsed."""
+    """Represents an individual records in the scores file. The constructor expects a raw bytes-like instance of a single record, which will be parsed.
+
+    The record is copied on construction, so the caller is free to reuse the buffer afterwards."""
+    # There's one of these per record in the file, so avoid the per-instance __dict__
+    __slots__ = ('raw', 'level', 'label', 'rest', 'val_type', 'value', 'mid_chunk')
+
     def __init__(self, raw):
+        # { appears to be the record end marker
+        if not raw or raw[-1] != 0x7b:
+            # Only include the start of the record, as this is hit on every retry while the buffer grows
+            raise ValueError(f"Found a record without the record end byte? {bytes(raw[:64])!r}")
         # Need to prepend the start marker that gets stripped by the split
         self.raw = b'\x7e' + raw
-        # { appears to be the record end marker
-        stripped = raw.rstrip(b'{')
-        if stripped == raw:
-            raise ValueError("Found a record without the record end byte? " + str(raw))
-        raw = stripped
-
-        identifierLen = raw[0]
-        identifier = raw[1:1+identifierLen].decode()
-
-        for i, c in enumerate(identifier):
-            if not c.isdecimal():
-                break
-        self.level = identifier[0:i]
-        self.label = identifier[i:]
-        self.rest  = raw[1+identifierLen:]
-
-        # Numeric values appear to be at the end of records, strings are variable length.
-        if self.label in ['seconds', 'minutes']:
-            self.val_type = 'float'
-            self.value = struct.unpack('<f', self.rest[-4:])[0]
-        elif self.label in ['name']:
-            self.val_type = 'string'
-            # TODO: why do string values start at this position?
-            lenValue = self.rest[9]
-            self.value = self.rest[10:10+lenValue].decode("utf-8")
-            if len(self.value) != lenValue:
-                printerr(f"String length value {lenvalue} does not match extracted string '{self.value}'")
+        # Almost always there's just the one end byte, but strip any others like rstrip would
+        end = len(self.raw) - 1
+        while self.raw[end-1] == 0x7b:
+            end -= 1
+        raw = self.raw[:end]
+
+        identifierLen = raw[1]
+        identifier = raw[2:2+identifierLen]
+
+        # The identifier is the level number followed immediately by the label
+        split_pos = len(identifier) - len(identifier.lstrip(b'0123456789'))
+        self.level = identifier[:split_pos].decode('utf-8')
+        self.label = identifier[split_pos:].decode('utf-8')
+        self.rest  = raw[2+identifierLen:]
+
+        parser = label_parsers.get(self.label, parse_int)
+        val_type, shape = record_shape(identifierLen, self.label, parser) if parser is not parse_string else (None, None)
+
+        if shape is not None and len(raw) == shape.size:
+            self.val_type = val_type
+            self.mid_chunk, self.value = shape.unpack(raw)
+            if val_type == 'int':
+                check_int(self.level, self.label, self.value)
         else:
-            self.val_type = 'int'
-            self.value = int.from_bytes(self.rest[-4:], byteorder='little')
-            if self.label == 'levelbeaten' and self.value != int(self.level):
-                printerr(f"levelbeaten value {self.value} does not match expected value of the level tag {self.level}")
-
-        self.mid_chunk = bytes(self.rest[0:9])
+            self.val_type, self.value = parser(self.rest, self.level, self.label)
+            self.mid_chunk = self.rest[:9]
 
     def detail_breakdown(self):
-        # [[readable, raw_len], ...] raw_len of -1 means calculate based on the readable value
-        parsed_start = [['^', 1], ['s:', 1], [self.level, -1], [self.label, -1]]
-        parsed_end   = []
+        # Parallel tuples of the readable value of each field, and the number of raw bytes that field covers
+        start_labels = ('^', 's:', self.level, self.label)
+        start_lens   = (1, 1, len(self.level.encode('utf-8')), len(self.label.encode('utf-8')))
 
         if self.val_type in ['float','int']:
-            parsed_end.append([self.value, 4])
+            end_labels = (self.value, '$')
+            end_lens   = (4, 1)
         else:
             detail_display = f"s[{len(self.value)}]{{{self.value}}}"
-            parsed_end.append([detail_display, len(self.value.encode('utf-8')) + 1])
-
-        parsed_end.append(['$', 1])
-
-        accounted_for = 0
-        for x in parsed_start + parsed_end:
-            if x[1] == -1:
-                x[1] = len(x[0].encode('utf-8'))
-            accounted_for += x[1]
+            end_labels = (detail_display, '$')
+            end_lens   = (len(self.value.encode('utf-8')) + 1, 1)
 
-        if accounted_for < len(self.raw):
-            parsed_start.append(['?', len(self.raw) - accounted_for])
+        unaccounted = len(self.raw) - sum(start_lens) - sum(end_lens)
+        if unaccounted > 0:
+            start_labels += ('?',)
+            start_lens   += (unaccounted,)
 
-        detail = parsed_start + parsed_end
+        labels = start_labels + end_labels
+        lens   = start_lens + end_lens
         cols = []
-        i = 0
-        for c_i, d in enumerate(detail):
-            j = i + d[1]
-            raw_slice = self.raw[i:j]
-            i = j
-
-            if len(cols) == c_i:
-                cols.append([])
-
-            cols[c_i].extend([str(d[0]), format_bytes(raw_slice), format_decimals(raw_slice)])
+        for label, end, length in zip(labels, itertools.accumulate(lens), lens):
+            cols.append((str(label), *format_bytes_and_decimals(self.raw[end-length:end])))
 
         return cols
 
@@ -176,43 +255,81 @@ class ScoreRecord:
         return "[" + str(self.level) + "] " + self.label + ": " + str(self.value) + " " + str(self.rest)
 
 def print_detail(batched_cols):
-    '''Takes an iterable of ScoreRecord.detail_breakdown() outputs, and pretty prints them to stdout.'''
+    '''Takes an iterable of ScoreRecord.detail_breakdown() outputs, and pretty prints them to stdout.
+
+    The iterable is only consumed once, so can be a generator. Columns are aligned across every batch, so all of the
+    formatted cells are held until the end, but not the breakdowns themselves.'''
     output_labels = ['parsed', 'hex', 'dec']
     max_len = max([len(l) for l in output_labels])
     output_labels = [l.ljust(max_len, '-') + '> ' for l in output_labels]
 
     lines = []
-    max_cols = max([len(l) for l in batched_cols])
-    widths = [0] * max_cols
+    widths = []
     for cols in batched_cols:
         lines.append([])
-        batch_lines = []
+        if len(cols) > len(widths):
+            widths.extend([0] * (len(cols) - len(widths)))
+        # Each column holds exactly one value per output label
+        batch_lines = [[] for _ in output_labels]
         for c_i, col in enumerate(cols):
-            widths[c_i] = max([widths[c_i]] + [len(s) for s in col])
-            for l_i, v in enumerate(col):
-                if len(batch_lines) == l_i:
-                    batch_lines.append([])
-                batch_lines[l_i].append(v)
+            # Widen the column as each value is placed, rather than in a separate pass over the column
+            width = widths[c_i]
+            for line, v in zip(batch_lines, col):
+                line.append(v)
+                if len(v) > width:
+                    width = len(v)
+            widths[c_i] = width
         lines.extend(batch_lines) # TODO: should this be append instead, and then we don't need the empty array append above?
 
+    out = sys.stdout.write
     label_i = 0
     for l in lines:
         if len(l) == 0:
             # Batch separator
-            print('\n')
+            out('\n\n')
             label_i = 0
             continue
         if label_i < len(output_labels):
-            print(output_labels[label_i], end='')
+            out(output_labels[label_i])
             label_i += 1
         for w, c, v in zip(widths, itertools.cycle(colours), l):
-            print(colored(v.ljust(w), c), end='|')
-        print('')
-
-def split_scores(path):
-    with open(path, 'rb') as infile:
-        saves = infile.read()
-        return saves.split(b'\x7e')[1:]
+            out(colored(v.ljust(w), c) + '|')
+        out('\n')
+
+def split_scores(path, chunk_size=1<<16):
+    '''Lazily yields the raw records in the scores file at path, split on the record start marker.
+
+    Anything before the first start marker is discarded, and the marker itself is stripped from each record.'''
+    with open(path, 'rb', buffering=chunk_size) as infile:
+        buf = bytearray()
+        start = None
+        while True:
+            chunk = infile.read1(chunk_size)
+            if not chunk:
+                break
+            scan = len(buf)
+            buf += chunk
+            # Don't bother keeping anything until the first start marker turns up
+            if start is None:
+                i = buf.find(b'\x7e', scan)
+                if i == -1:
+                    buf.clear()
+                    continue
+                start = i + 1
+                scan = start
+            # Slicing a view copies each record out once, rather than into a bytearray and then again into bytes.
+            # The view must be released before the buffer can be resized below.
+            with memoryview(buf) as view:
+                i = buf.find(b'\x7e', scan)
+                while i != -1:
+                    yield bytes(view[start:i])
+                    start = i + 1
+                    i = buf.find(b'\x7e', start)
+            # Drop the consumed prefix so the buffer only holds the current partial record
+            del buf[:start]
+            start = 0
+        if start is not None:
+            yield bytes(buf)
 
 if __name__ == '__main__':
     if len(sys.argv) < 2:
@@ -222,30 +339,27 @@ if __name__ == '__main__':
     recordbuff = bytearray()
     scores = Scores()
     for raw in records:
-        if len(recordbuff) > 0:
-            raw = recordbuff + raw
+        recordbuff += raw
         try:
-            record = ScoreRecord(raw)
-            recordbuff = bytearray()
-            scores.add_record(record)
+            record = ScoreRecord(recordbuff)
         except ValueError:
             # Splitting on the supposed record start marker isn't quite right because there's nothing stopping it appearing in values
             # If we fail, ensure the end marker is present (though of course this suffers the same problem, albeit less frequently)
-            recordbuff.extend(raw)
+            # The failed record is left in the buffer, so the next split gets appended to it
             printerr("Got truncated record, trying to extend the buffer...")
+            continue
+        recordbuff.clear()
+        try:
+            scores.add_record(record)
+        except ValueError as e:
+            # The record parsed, so appending the next split to it won't help; drop it rather than swallowing the rest of the file
+            printerr(f"Skipping [{record.level}] {record.label} record that could not be added: {e}")
 
-    batched_cols = [r.detail_breakdown() for l in scores.get_levels() for r in l.get_records()]
-    print_detail(batched_cols)
+    print_detail(r.detail_breakdown() for l in scores.get_levels() for r in l.get_records())
 
     print('\n----- middle chunk breakdown -----\n')
 
-    # Bin records by the first mystery byte
-    chunk_buckets = {}
-    rec_count = 0
-    for r in scores.get_records_by_label('name'):
-        rec_count += 1
-        mid = r.mid_chunk[0]
-        chunk_buckets[mid] = len(r.value)
-    print(f"Processed {rec_count} records:")
-    for mid, length in sorted(chunk_buckets.items(), key=lambda vals: vals[1]):
+    # Records were binned by the first mystery byte as they were added
+    print(f"Processed {scores.get_name_count()} records:")
+    for mid, length in scores.get_chunk_buckets():
         print(f"{mid}: {length} {mid - length}")